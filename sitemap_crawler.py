@@ -4,23 +4,646 @@
 Webサイトの階層構造を取得してCSV/HTML形式で出力するクローラー
 """
 
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import aiohttp
+from concurrent.futures import ThreadPoolExecutor
+from lxml import etree
 from urllib.parse import urljoin, urlparse, urldefrag
+from urllib.robotparser import RobotFileParser
+from email.utils import parsedate_to_datetime
 import re
+import os
+import sys
+import json
+import hashlib
+import codecs
+import zlib
+import functools
 import csv
 from collections import defaultdict
-from typing import Set, Dict, List, Tuple
+from dataclasses import dataclass
+from itertools import chain
+from operator import itemgetter
+from html import escape
+from typing import Set, Dict, List, Tuple, Optional, Pattern, Iterator, NamedTuple
 import time
 
 
+# URLエンコード部分（%XX）にマッチする正規表現
+PERCENT_ENCODING_PATTERN = re.compile(r'%([0-9A-Fa-f]{2})')
+
+# プルパーサーに一度に渡すバイト数
+PARSE_CHUNK_SIZE = 16384
+
+# 1回のクロールで読み込むsitemap.xml（インデックス含む）の上限
+MAX_SITEMAPS = 50
+
+# 文字コード判定のために先読みするバイト数の上限
+# （metaタグの前に長いscriptやコメントがあるページに備え、BeautifulSoupの2048バイトより広めに取る）
+ENCODING_PRESCAN_SIZE = 8192
+
+# <meta charset="..."> と <meta http-equiv="Content-Type" content="...; charset=..."> の両方にマッチ
+# （チャンクの境目で途切れた名前を拾わないよう、名前の後ろの文字まで届いてから一致させる）
+META_CHARSET_PATTERN = re.compile(rb'<meta[^>]*?charset\s*=\s*["\']?\s*([A-Za-z0-9_.:-]+)(?=[^A-Za-z0-9_.:-])',
+                                  re.IGNORECASE)
+
+# これ以降にmetaタグの文字コード宣言は来ないとみなす位置
+HEAD_END_PATTERN = re.compile(rb'</head|<body', re.IGNORECASE)
+
+# 先頭のBOMと対応する文字コード
+BOM_ENCODINGS = (
+    (b'\xef\xbb\xbf', 'utf-8'),
+    (b'\xff\xfe', 'utf-16le'),
+    (b'\xfe\xff', 'utf-16be'),
+)
+
+
+def find_declared_encoding(head: bytes) -> Optional[str]:
+    """
+    HTML先頭のBOM、<meta>の宣言の順に文字コードを探す
+
+    Args:
+        head: HTMLバイト列の先頭部分
+
+    Returns:
+        文字コード名（宣言が見つからない場合None）
+    """
+    for bom, encoding in BOM_ENCODINGS:
+        if head.startswith(bom):
+            return encoding
+
+    match = META_CHARSET_PATTERN.search(head, 0, ENCODING_PRESCAN_SIZE)
+    if match:
+        return match.group(1).decode('ascii')
+    return None
+
+
+def is_prescan_complete(head: bytes) -> bool:
+    """
+    文字コードを確定できるだけ先頭部分が溜まったかを判定
+
+    宣言が見つかった、</head>（または<body>）に達した、先読み上限に達したのいずれか
+
+    Args:
+        head: これまでに受信したHTMLバイト列
+
+    Returns:
+        判定できる場合True
+    """
+    return (len(head) >= ENCODING_PRESCAN_SIZE
+            or find_declared_encoding(head) is not None
+            or HEAD_END_PATTERN.search(head) is not None)
+
+
+def detect_html_encoding(head: bytes) -> str:
+    """
+    HTTPヘッダーに文字コードがない場合に、HTML先頭から文字コードを判定
+
+    BOM、<meta>の宣言の順に調べ、どちらもなければUTF-8とする。
+    lxmlに文字コードを渡さないとlibxml2がLatin-1とみなして文字化けするため
+
+    Args:
+        head: HTMLバイト列の先頭部分
+
+    Returns:
+        文字コード名
+    """
+    return find_declared_encoding(head) or 'utf-8'
+
+
+class PageParser:
+    """
+    分割して受信したHTMLからタイトルとリンクを抽出するパーサー
+
+    DOMツリー全体を保持せず、閉じた要素から順に破棄する
+    """
+
+    def __init__(self, encoding: Optional[str] = None):
+        """
+        Args:
+            encoding: HTMLの文字コード（Noneの場合はBOM・metaタグから判定）
+        """
+        self.encoding = encoding
+        self.parser: Optional[etree.HTMLPullParser] = None
+        # 文字コード判定が済むまで先頭部分を溜めておく
+        self.head = b''
+        self.title: Optional[str] = None
+        self.hrefs: List[str] = []
+
+    def _start(self, data: bytes):
+        """文字コードを確定させてパーサーを作成し、溜めておいた先頭部分を渡す"""
+        # libxml2が知らない名前はPythonの正式名（euc_jp→euc-jpなど）、文書内の宣言、
+        # UTF-8の順に試す（文字コードなしで渡すとLatin-1とみなされ文字化けする）
+        candidates = [self.encoding or detect_html_encoding(data)]
+        try:
+            candidates.append(codecs.lookup(candidates[0]).name.replace('_', '-'))
+        except LookupError:
+            pass
+        candidates += [detect_html_encoding(data), 'utf-8']
+
+        for encoding in candidates:
+            try:
+                self.parser = etree.HTMLPullParser(events=('start', 'end'), remove_comments=True, encoding=encoding)
+            except LookupError:
+                continue
+            self.encoding = encoding
+            break
+        self.parser.feed(data)
+
+    def feed(self, chunk: bytes):
+        """
+        HTMLの一部を解析
+
+        Args:
+            chunk: HTMLバイト列の一部
+        """
+        if self.parser is not None:
+            self.parser.feed(chunk)
+        elif self.encoding is not None:
+            self._start(chunk)
+        else:
+            self.head += chunk
+            if not is_prescan_complete(self.head):
+                return
+            self._start(self.head)
+            self.head = b''
+        self._read_events()
+
+    def close(self):
+        """残りのHTMLを解析して終了"""
+        if self.parser is None:
+            if not self.head:
+                return
+            self._start(self.head)
+            self.head = b''
+        try:
+            self.parser.close()
+        except etree.XMLSyntaxError:
+            # 空のドキュメントなど解析できない場合
+            return
+        self._read_events()
+
+    def _read_events(self):
+        """パーサーのイベントからタイトルとhref属性を回収し、処理済みの要素を破棄"""
+        for event, element in self.parser.read_events():
+            if event == 'start':
+                if element.tag == 'a':
+                    href = element.get('href')
+                    if href is not None:
+                        self.hrefs.append(href)
+                continue
+
+            # 最初のtitleタグのテキストをタイトルとする
+            if element.tag == 'title' and self.title is None:
+                self.title = element.text.strip() if element.text and len(element) == 0 else ''
+
+            # 閉じた要素の中身と、処理済みの兄弟要素を解放
+            element.clear(keep_tail=True)
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+
+class SitemapXmlParser:
+    """
+    分割して受信したsitemap.xmlから<loc>のURLを抽出するパーサー
+
+    gzip圧縮されたsitemap（.xml.gz）にも対応する
+    """
+
+    def __init__(self):
+        self.parser = etree.XMLPullParser(events=('end',), recover=True, resolve_entities=False, no_network=True)
+        self.decompressor = None
+        self.started = False
+        self.page_urls: List[str] = []  # <urlset>内のページURL
+        self.sitemap_urls: List[str] = []  # <sitemapindex>内の子sitemapのURL
+
+    def feed(self, chunk: bytes):
+        """
+        sitemap.xmlの一部を解析
+
+        Args:
+            chunk: バイト列の一部
+        """
+        # 先頭がgzipのマジックナンバーの場合は展開しながら解析
+        if not self.started:
+            self.started = True
+            if chunk[:2] == b'\x1f\x8b':
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        if self.decompressor is not None:
+            chunk = self.decompressor.decompress(chunk)
+
+        self.parser.feed(chunk)
+        self._read_events()
+
+    def close(self):
+        """残りを解析して終了"""
+        try:
+            self.parser.close()
+        except etree.XMLSyntaxError:
+            return
+        self._read_events()
+
+    def _read_events(self):
+        """パーサーのイベントから<loc>を回収し、処理済みの要素を破棄"""
+        for _, element in self.parser.read_events():
+            if not isinstance(element.tag, str):
+                continue
+
+            tag = etree.QName(element).localname
+            if tag == 'loc' and element.text:
+                parent = element.getparent()
+                parent_tag = etree.QName(parent).localname if parent is not None else ''
+                if parent_tag == 'sitemap':
+                    self.sitemap_urls.append(element.text.strip())
+                elif parent_tag == 'url':
+                    self.page_urls.append(element.text.strip())
+            elif tag in ('url', 'sitemap'):
+                # 処理済みのエントリを解放
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+
+@functools.lru_cache(maxsize=100_000)
+def normalize_url(url: str) -> str:
+    """
+    URLを正規化（末尾スラッシュありに統一、URLエンコード部分を小文字に統一）
+
+    Args:
+        url: 正規化するURL
+
+    Returns:
+        正規化されたURL
+    """
+    # URLエンコード部分を小文字に統一（%E3 -> %e3）
+    url = PERCENT_ENCODING_PATTERN.sub(lambda m: m.group(0).lower(), url)
+
+    parsed = urlparse(url)
+    path = parsed.path
+
+    # パスが空の場合は/を設定
+    if not path:
+        path = '/'
+    # 拡張子がない、またはディレクトリの場合は末尾に/を追加
+    elif not path.endswith('/'):
+        # 最後のセグメントに拡張子があるかチェック
+        last_segment = path.split('/')[-1]
+        if '.' not in last_segment:
+            # 拡張子がない場合は/を追加
+            path = path + '/'
+
+    # URLを再構築
+    normalized = f"{parsed.scheme}://{parsed.netloc}{path}"
+    if parsed.query:
+        normalized += f"?{parsed.query}"
+
+    return normalized
+
+
+@functools.lru_cache(maxsize=100_000)
+def is_valid_url(url: str, base_domain: str, base_path: str,
+                 excluded_pattern: Pattern, allowed_pattern: Pattern) -> bool:
+    """
+    URLが取得対象かどうかを判定
+
+    Args:
+        url: チェックするURL
+        base_domain: 対象ドメイン
+        base_path: 対象パス（末尾スラッシュなし）
+        excluded_pattern: 除外する拡張子にマッチする正規表現
+        allowed_pattern: 許可する末尾パターンにマッチする正規表現
+
+    Returns:
+        有効なURLの場合True
+    """
+    # フラグメント(#)を除去
+    url, _ = urldefrag(url)
+
+    # 空URLはスキップ
+    if not url:
+        return False
+
+    # 同一ドメインのみ
+    parsed = urlparse(url)
+    if parsed.netloc != base_domain:
+        return False
+
+    # 指定したURL以下の階層のみ許可（上位階層は除外）
+    url_path = parsed.path.rstrip('/')
+    # base_pathが空またはルートでない場合のみチェック
+    if base_path and base_path != '/':
+        # URLパスがbase_pathと完全一致、またはbase_path + '/'で始まる場合のみ許可
+        if url_path != base_path and not url_path.startswith(base_path + '/'):
+            return False
+
+    # URL引数付きはスキップ
+    if '?' in url:
+        return False
+
+    # 除外拡張子チェック
+    if excluded_pattern.search(parsed.path):
+        return False
+
+    # 許可される末尾パターンをチェック
+    has_allowed_ending = bool(allowed_pattern.search(parsed.path))
+
+    # 拡張子なしの場合
+    if '.' not in parsed.path.split('/')[-1]:
+        # 末尾が/でない場合は後でContent-Typeチェックが必要
+        return True
+
+    # 拡張子ありの場合は許可パターンのみOK
+    return has_allowed_ending
+
+
+@functools.lru_cache(maxsize=100_000)
+def calculate_depth(url: str, base_path: str) -> int:
+    """
+    URLの階層深度を計算
+
+    Args:
+        url: 対象URL
+        base_path: 深度0とするパス（末尾スラッシュなし）
+
+    Returns:
+        階層深度（base_pathを0とする）
+    """
+    url_path = urlparse(url).path.rstrip('/')
+
+    # base_pathと比較
+    if url_path == base_path:
+        return 0
+
+    # base_pathからの相対パスを取得
+    if base_path and url_path.startswith(base_path + '/'):
+        # base_pathが空でない場合
+        relative_path = url_path[len(base_path):].strip('/')
+    elif base_path == '' or base_path == '/':
+        # base_pathが空またはルートの場合
+        relative_path = url_path.strip('/')
+    else:
+        # base_pathがプレフィックスでない場合
+        relative_path = url_path.strip('/')
+
+    if not relative_path:
+        return 0
+
+    return len(relative_path.split('/'))
+
+
+class HostRateLimiter:
+    """
+    ホスト単位で同時接続数とアクセス間隔を制限するトークンバケット
+
+    応答が速く成功が続く間はレートを少しずつ上げ、429/5xxや通信エラー時は
+    半減させる（しばらくは再上昇しない）
+    """
+
+    def __init__(self, rate: float, concurrency: int, max_rate: float,
+                 min_rate: float = 0.5, target_latency: float = 1.0, cooldown: float = 10.0):
+        """
+        Args:
+            rate: 1秒あたりに許可するリクエスト数（初期値）
+            concurrency: 同時に処理できるリクエスト数
+            max_rate: レートの上限
+            min_rate: レートの下限
+            target_latency: これを超える応答時間（秒）ではレートを下げる
+            cooldown: エラー後にレートを上げずに待つ秒数
+        """
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.cooldown_until = 0.0
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        try:
+            await self._take_token()
+        except BaseException:
+            self.semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.semaphore.release()
+
+    async def _take_token(self):
+        """トークンが補充されるまで待機して1つ消費"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                # Retry-Afterで指定された期間は待機
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def record(self, status: Optional[int], latency: float):
+        """
+        応答結果に応じてレートを調整
+
+        Args:
+            status: HTTPステータス（通信エラーの場合はNone）
+            latency: レスポンスヘッダー受信までの秒数
+        """
+        now = time.monotonic()
+
+        if status is None or status == 429 or status >= 500:
+            # サーバーが過負荷の可能性があるため半減
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.cooldown_until = now + self.cooldown
+        elif latency > self.target_latency:
+            # 応答が遅くなってきたら少し下げる
+            self.rate = max(self.min_rate, self.rate * 0.9)
+        elif now >= self.cooldown_until:
+            # 速い応答が続く間は少しずつ上げる
+            self.rate = min(self.max_rate, self.rate + 0.2)
+
+        self.capacity = max(1.0, self.rate)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def defer(self, retry_after: Optional[str]):
+        """
+        Retry-Afterヘッダーに従ってホストへのアクセスを一時停止
+
+        Args:
+            retry_after: Retry-Afterヘッダーの値（秒数またはHTTP日付）
+        """
+        if not retry_after:
+            return
+
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return
+
+        if delay > 0:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+
+
+@dataclass(slots=True)
+class PageRecord:
+    """取得したページの情報"""
+
+    title: str
+    depth: int
+    parent: Optional[str]
+    status: str = 'ok'  # 'ok': 取得したページ, 'redirect': リダイレクト先として記録したページ
+
+
+class ChildRef(NamedTuple):
+    """親ページから子ページへの参照（url_treeの要素）"""
+
+    url: str
+    title: str
+    depth: int
+
+
+class PageCache:
+    """取得したページの解析結果をURL単位でディスクに保存するキャッシュ"""
+
+    def __init__(self, directory: str, ttl: float):
+        """
+        Args:
+            directory: キャッシュの保存先ディレクトリ
+            ttl: 再検証せずにキャッシュを使う秒数
+        """
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        """
+        URLに対応するキャッシュファイルのパスを取得
+
+        Args:
+            url: 対象URL
+
+        Returns:
+            キャッシュファイルのパス
+        """
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + '.json')
+
+    def _write(self, entry: Dict):
+        """一時ファイル経由でアトミックに書き込み"""
+        path = self._path(entry['url'])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def load(self, url: str) -> Optional[Dict]:
+        """
+        キャッシュされたページを取得
+
+        Args:
+            url: 対象URL
+
+        Returns:
+            タイトル・リンク・検証用ヘッダーの辞書、存在しない場合はNone
+        """
+        try:
+            with open(self._path(url), encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # ハッシュ衝突や旧形式のキャッシュは使わない
+        if entry.get('url') != url or 'hrefs' not in entry:
+            return None
+
+        return entry
+
+    def is_fresh(self, entry: Dict) -> bool:
+        """
+        キャッシュがTTL内かどうかを判定
+
+        Args:
+            entry: loadで取得したキャッシュ
+
+        Returns:
+            再検証が不要な場合True
+        """
+        return time.time() - entry.get('fetched_at', 0) < self.ttl
+
+    def store(self, url: str, hrefs: List[str], title: str, final_url: str,
+              etag: Optional[str], last_modified: Optional[str]):
+        """
+        ページの解析結果をキャッシュに保存
+
+        Args:
+            url: 取得したURL
+            hrefs: ページ内のhref属性値のリスト
+            title: ページタイトル
+            final_url: リダイレクト後の最終URL
+            etag: ETagヘッダーの値
+            last_modified: Last-Modifiedヘッダーの値
+        """
+        self._write({
+            'url': url,
+            'hrefs': hrefs,
+            'title': title,
+            'final_url': final_url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': time.time()
+        })
+
+    def touch(self, entry: Dict):
+        """
+        再検証済みのキャッシュの取得日時を更新
+
+        Args:
+            entry: loadで取得したキャッシュ
+        """
+        entry['fetched_at'] = time.time()
+        self._write(entry)
+
+
 class SitemapCrawler:
     """サイトマップを作成するクローラー"""
 
-    def __init__(self, base_url: str):
+    # リトライ対象のHTTPステータス
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, base_url: str, max_workers: int = 16, per_host_limit: int = 8,
+                 requests_per_second: float = 2.0, max_requests_per_second: float = 20.0,
+                 max_retries: int = 3, backoff_factor: float = 0.5,
+                 cache_dir: Optional[str] = '.cache', cache_ttl: float = 3600,
+                 respect_robots: bool = True, use_sitemap: bool = True):
         """
         Args:
             base_url: クロール開始URL
+            max_workers: 並行して動作するワーカー数
+            per_host_limit: 1ホストあたりの同時接続数
+            requests_per_second: 1ホストあたりの初期リクエスト数/秒（応答に応じて自動調整）
+            max_requests_per_second: 1ホストあたりのリクエスト数/秒の上限
+            max_retries: 一時的なエラー時のリトライ回数
+            backoff_factor: リトライ間隔の基準秒数（指数的に増加）
+            cache_dir: ページキャッシュの保存先（Noneでキャッシュ無効）
+            cache_ttl: キャッシュを再検証せずに使う秒数
+            respect_robots: robots.txtで禁止されたURLを取得しない
+            use_sitemap: sitemap.xmlに記載されたURLをクロール対象に追加
         """
         # base_urlを正規化
         parsed = urlparse(base_url)
@@ -30,14 +653,17 @@ class SitemapCrawler:
         self.base_url = f"{parsed.scheme}://{parsed.netloc}{path}"
 
         self.base_domain = parsed.netloc
-        self.visited_urls: Set[str] = set()
-        self.url_tree: Dict[str, List[Dict]] = defaultdict(list)
-        self.url_titles: Dict[str, str] = {}
-        self.url_depths: Dict[str, int] = {}
+        self.pages: Dict[str, PageRecord] = {}  # 訪問済みURL: ページ情報
+        self.url_tree: Dict[str, List[ChildRef]] = defaultdict(list)
         self.failed_urls: Dict[str, str] = {}  # URL: エラー理由
+        self.seen_urls: Set[str] = set()  # キューに投入済みのURL
+        # sitemap.xmlから親なしで投入し、まだどのページからもリンクされていないURL
+        self.unlinked_urls: Set[str] = set()
+        # sitemap.xmlから投入したURLのうち、クロール前にリンク元が見つかったもの: 親URL
+        self.link_parents: Dict[str, str] = {}
 
         # 除外する拡張子
-        self.excluded_extensions = {
+        self.excluded_extensions = frozenset({
             # 画像
             '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.svg', '.webp', '.ico',
             # ドキュメント
@@ -49,19 +675,62 @@ class SitemapCrawler:
             '.mp4', '.avi', '.mov', '.mp3', '.wav',
             # その他
             '.xml', '.json', '.css', '.js'
-        }
+        })
 
         # 許可する末尾パターン
-        self.allowed_endings = ['/', '.html', '.htm', '.php']
+        self.allowed_endings = ('/', '.html', '.htm', '.php')
+
+        # 末尾判定用の正規表現（1回の検索で全パターンを判定）
+        self.excluded_pattern = self._compile_suffix_pattern(self.excluded_extensions)
+        self.allowed_pattern = self._compile_suffix_pattern(self.allowed_endings)
 
-        # HTTPヘッダー
+        # HTTPヘッダー（圧縮転送はaiohttpが対応形式を自動で指定・展開）
         self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+            'Accept': 'text/html,application/xhtml+xml;q=0.9,*/*;q=0.8'
         }
 
         # base_urlのパスを正規化（末尾スラッシュを除去）
         self.base_path = urlparse(self.base_url).path.rstrip('/')
 
+        # 並行クロール設定
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.requests_per_second = requests_per_second
+        self.max_requests_per_second = max_requests_per_second
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+        # HTTPセッション（crawl_all実行中のみ有効）
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.limiters: Dict[str, HostRateLimiter] = {}
+
+        # HTML解析用スレッド（crawl_all実行中のみ有効）
+        # lxmlのパーサーは作成したスレッド以外から使えないため1スレッドに固定
+        self.parse_executor: Optional[ThreadPoolExecutor] = None
+
+        # ページキャッシュ（再実行時は条件付きリクエストで差分のみ取得）
+        self.cache: Optional[PageCache] = PageCache(cache_dir, cache_ttl) if cache_dir else None
+
+        # robots.txt・sitemap.xml（crawl_all開始時に読み込み）
+        self.respect_robots = respect_robots
+        self.use_sitemap = use_sitemap
+        self.robots: Optional[RobotFileParser] = None
+
+    @staticmethod
+    def _compile_suffix_pattern(suffixes) -> Pattern:
+        """
+        末尾文字列のいずれかにマッチする正規表現を生成
+
+        Args:
+            suffixes: 末尾文字列の集合
+
+        Returns:
+            大文字小文字を区別しない正規表現
+        """
+        alternatives = '|'.join(re.escape(suffix) for suffix in sorted(suffixes))
+        return re.compile(f'(?:{alternatives})$', re.IGNORECASE)
+
     def normalize_url(self, url: str) -> str:
         """
         URLを正規化（末尾スラッシュありに統一、URLエンコード部分を小文字に統一）
@@ -72,29 +741,7 @@ class SitemapCrawler:
         Returns:
             正規化されたURL
         """
-        # URLエンコード部分を小文字に統一（%E3 -> %e3）
-        url = re.sub(r'%([0-9A-Fa-f]{2})', lambda m: m.group(0).lower(), url)
-
-        parsed = urlparse(url)
-        path = parsed.path
-
-        # パスが空の場合は/を設定
-        if not path:
-            path = '/'
-        # 拡張子がない、またはディレクトリの場合は末尾に/を追加
-        elif not path.endswith('/'):
-            # 最後のセグメントに拡張子があるかチェック
-            last_segment = path.split('/')[-1]
-            if '.' not in last_segment:
-                # 拡張子がない場合は/を追加
-                path = path + '/'
-
-        # URLを再構築
-        normalized = f"{parsed.scheme}://{parsed.netloc}{path}"
-        if parsed.query:
-            normalized += f"?{parsed.query}"
-
-        return normalized
+        return normalize_url(url)
 
     def is_valid_url(self, url: str) -> bool:
         """
@@ -106,135 +753,152 @@ class SitemapCrawler:
         Returns:
             有効なURLの場合True
         """
-        # フラグメント(#)を除去
-        url, _ = urldefrag(url)
+        return is_valid_url(url, self.base_domain, self.base_path,
+                            self.excluded_pattern, self.allowed_pattern)
 
-        # 空URLはスキップ
-        if not url:
-            return False
-
-        # 同一ドメインのみ
-        parsed = urlparse(url)
-        if parsed.netloc != self.base_domain:
-            return False
-
-        # 指定したURL以下の階層のみ許可（上位階層は除外）
-        url_path = parsed.path.rstrip('/')
-        # base_pathが空またはルートでない場合のみチェック
-        if self.base_path and self.base_path != '/':
-            # URLパスがbase_pathと完全一致、またはbase_path + '/'で始まる場合のみ許可
-            if url_path != self.base_path and not url_path.startswith(self.base_path + '/'):
-                return False
-
-        # URL引数付きはスキップ
-        if '?' in url:
-            return False
-
-        # 除外拡張子チェック
-        path_lower = parsed.path.lower()
-        for ext in self.excluded_extensions:
-            if path_lower.endswith(ext):
-                return False
-
-        # 許可される末尾パターンをチェック
-        has_allowed_ending = any(path_lower.endswith(ending) for ending in self.allowed_endings)
-
-        # 拡張子なしの場合
-        if '.' not in parsed.path.split('/')[-1]:
-            # 末尾が/でない場合は後でContent-Typeチェックが必要
-            return True
+    def get_limiter(self, url: str) -> HostRateLimiter:
+        """
+        URLのホストに対応するレートリミッターを取得
 
-        # 拡張子ありの場合は許可パターンのみOK
-        return has_allowed_ending
+        Args:
+            url: 対象URL
 
-    def get_page_content(self, url: str) -> Tuple[str, str, str, str]:
+        Returns:
+            ホスト単位のレートリミッター
         """
-        ページのHTMLコンテンツとタイトルを取得
+        host = urlparse(url).netloc
+        limiter = self.limiters.get(host)
+        if limiter is None:
+            limiter = HostRateLimiter(self.requests_per_second, self.per_host_limit, self.max_requests_per_second)
+            self.limiters[host] = limiter
+        return limiter
+
+    async def get_page_content(self, url: str) -> Tuple[List[str], str, str, str]:
+        """
+        ページを取得し、受信しながらタイトルとリンクを抽出
 
         Args:
             url: 取得するURL
 
         Returns:
-            (HTML文字列, ページタイトル, 最終URL, エラーメッセージ)のタプル
+            (href属性値のリスト, ページタイトル, 最終URL, エラーメッセージ)のタプル
             リダイレクトされた場合は最終URLを返す
         """
-        try:
-            response = requests.get(url, headers=self.headers, timeout=10)
-
-            # Content-Typeチェック
-            content_type = response.headers.get('Content-Type', '')
-            if 'text/html' not in content_type:
-                return None, None, None, f"Content-Type: {content_type}"
-
-            # ステータスコードチェック
-            if response.status_code != 200:
-                return None, None, None, f"HTTP {response.status_code}"
-
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            # タイトル取得
-            title = ''
-            if soup.title:
-                title = soup.title.string.strip() if soup.title.string else ''
-
-            # 最終URLを取得（リダイレクト後）
-            final_url = response.url
+        # キャッシュがTTL内であればネットワークにアクセスしない
+        cached = None
+        headers = {}
+        if self.cache is not None:
+            cached = await asyncio.to_thread(self.cache.load, url)
+            if cached is not None:
+                if self.cache.is_fresh(cached):
+                    return cached['hrefs'], cached['title'], cached['final_url'], None
+
+                # 条件付きリクエストで更新有無のみ確認
+                if cached.get('etag'):
+                    headers['If-None-Match'] = cached['etag']
+                if cached.get('last_modified'):
+                    headers['If-Modified-Since'] = cached['last_modified']
+
+        limiter = self.get_limiter(url)
+        error_msg = "不明なエラー"
+
+        for attempt in range(self.max_retries + 1):
+            # リトライ時は指数バックオフで待機
+            if attempt:
+                await asyncio.sleep(self.backoff_factor * (2 ** (attempt - 1)))
+
+            try:
+                async with limiter:
+                    started = time.monotonic()
+                    async with self.session.get(url, headers=headers, allow_redirects=True) as response:
+                        limiter.record(response.status, time.monotonic() - started)
+
+                        # 一時的なエラーはリトライ（Retry-Afterがあれば従う）
+                        if response.status in self.RETRY_STATUSES and attempt < self.max_retries:
+                            limiter.defer(response.headers.get('Retry-After'))
+                            continue
+
+                        # 更新されていなければキャッシュを使用
+                        if response.status == 304 and cached is not None:
+                            await asyncio.to_thread(self.cache.touch, cached)
+                            return cached['hrefs'], cached['title'], cached['final_url'], None
+
+                        # Content-Typeチェック（ヘッダーのみで判定し、本文は受信しない）
+                        content_type = response.headers.get('Content-Type', '')
+                        if 'text/html' not in content_type:
+                            response.close()
+                            return None, None, None, f"Content-Type: {content_type}"
+
+                        # ステータスコードチェック
+                        if response.status != 200:
+                            return None, None, None, f"HTTP {response.status}"
+
+                        # 本文全体を保持せず、受信したチャンクから順に解析
+                        # （イベントループを止めないよう、解析は専用スレッドで行う）
+                        loop = asyncio.get_running_loop()
+                        page = await loop.run_in_executor(self.parse_executor, PageParser, response.charset)
+                        async for chunk in response.content.iter_chunked(PARSE_CHUNK_SIZE):
+                            await loop.run_in_executor(self.parse_executor, page.feed, chunk)
+                        await loop.run_in_executor(self.parse_executor, page.close)
+
+                        # 最終URLを取得（リダイレクト後）
+                        final_url = str(response.url)
+                        etag = response.headers.get('ETag')
+                        last_modified = response.headers.get('Last-Modified')
+
+                title = page.title or ''
+
+                if self.cache is not None:
+                    await asyncio.to_thread(self.cache.store, url, page.hrefs, title, final_url, etag, last_modified)
+
+                return page.hrefs, title, final_url, None
+
+            except asyncio.TimeoutError:
+                error_msg = "タイムアウト"
+                limiter.record(None, 0)
+            except aiohttp.ClientConnectionError:
+                error_msg = "接続エラー"
+                limiter.record(None, 0)
+            except Exception as e:
+                error_msg = str(e)
+                break
+
+        print(f"エラー: {url} - {error_msg}")
+        return None, None, None, error_msg
+
+    def extract_links(self, hrefs: List[str], current_url: str) -> List[str]:
+        """
+        ページ内のリンクを絶対URLに変換
 
-            return response.text, title, final_url, None
+        Args:
+            hrefs: ページ内のhref属性値のリスト
+            current_url: 現在のページURL
 
-        except requests.exceptions.Timeout:
-            error_msg = "タイムアウト"
-            print(f"エラー: {url} - {error_msg}")
-            return None, None, None, error_msg
-        except requests.exceptions.ConnectionError:
-            error_msg = "接続エラー"
-            print(f"エラー: {url} - {error_msg}")
-            return None, None, None, error_msg
-        except Exception as e:
-            error_msg = str(e)
-            print(f"エラー: {url} - {error_msg}")
-            return None, None, None, error_msg
+        Returns:
+            フラグメントを除去した絶対URLのリスト（未検証）
+        """
+        # 絶対URLに変換し、フラグメントを除去
+        return [urldefrag(urljoin(current_url, href))[0] for href in hrefs]
 
-    def extract_links(self, html: str, current_url: str) -> Set[str]:
+    def filter_links(self, urls: List[str]) -> Set[str]:
         """
-        HTML内のリンクを抽出
+        抽出したURLをまとめて検証・正規化
 
         Args:
-            html: HTML文字列
-            current_url: 現在のページURL
+            urls: 絶対URLのリスト
 
         Returns:
-            抽出されたURLのセット
-        """
-        soup = BeautifulSoup(html, 'html.parser')
-        links = set()
-
-        for a_tag in soup.find_all('a', href=True):
-            href = a_tag['href']
-            # 絶対URLに変換
-            absolute_url = urljoin(current_url, href)
-
-            # フラグメントを除去
-            absolute_url, _ = urldefrag(absolute_url)
-
-            # URL引数付きのURLの場合、ベースURL（引数を除いた部分）を追加
-            if '?' in absolute_url:
-                parsed = urlparse(absolute_url)
-                # 同一ドメインの場合のみ
-                if parsed.netloc == self.base_domain:
-                    # URL引数を除いたベースURLを作成
-                    base_url = f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
-                    if self.is_valid_url(base_url):
-                        # URLを正規化（末尾スラッシュ統一）
-                        normalized_base_url = self.normalize_url(base_url)
-                        links.add(normalized_base_url)
-
-            if self.is_valid_url(absolute_url):
-                # URLを正規化（末尾スラッシュ統一）
-                normalized_url = self.normalize_url(absolute_url)
-                links.add(normalized_url)
-
-        return links
+            取得対象の正規化済みURLのセット
+        """
+        # URL引数付きのURLの場合、ベースURL（引数を除いた部分）も候補にする
+        base_urls = [url.split('?', 1)[0] for url in urls if '?' in url]
+
+        # 同じURLを複数の辞書・集合で共有するためインターン化
+        return {
+            sys.intern(self.normalize_url(url))
+            for url in chain(urls, base_urls)
+            if self.is_valid_url(url)
+        }
 
     def calculate_depth(self, url: str) -> int:
         """
@@ -246,41 +910,80 @@ class SitemapCrawler:
         Returns:
             階層深度（base_urlを0とする）
         """
-        url_path = urlparse(url).path.rstrip('/')
-
-        # base_pathと比較
-        if url_path == self.base_path:
-            return 0
-
-        # base_pathからの相対パスを取得
-        if self.base_path and url_path.startswith(self.base_path + '/'):
-            # base_pathが空でない場合
-            relative_path = url_path[len(self.base_path):].strip('/')
-        elif self.base_path == '' or self.base_path == '/':
-            # base_pathが空またはルートの場合
-            relative_path = url_path.strip('/')
-        else:
-            # base_pathがプレフィックスでない場合
-            relative_path = url_path.strip('/')
+        return calculate_depth(url, self.base_path)
 
-        if not relative_path:
-            return 0
+    async def crawl_all(self):
+        """
+        ワーカープールで幅優先に並行クロール
 
-        return len(relative_path.split('/'))
+        base_urlから開始し、キューが空になるまでリンクを辿る
+        各URLはキュー投入時に重複排除するため、1回だけ取得される
+        """
+        connector = aiohttp.TCPConnector(limit=64, limit_per_host=self.per_host_limit, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=10)
+        queue: asyncio.Queue = asyncio.Queue()
+
+        # 解析スレッドはセッションより後に止め、実行中の解析を待つ
+        with ThreadPoolExecutor(max_workers=1) as parse_executor:
+            self.parse_executor = parse_executor
+            async with aiohttp.ClientSession(headers=self.headers, connector=connector, timeout=timeout) as session:
+                self.session = session
+                start_url = sys.intern(self.normalize_url(self.base_url))
+                self.seen_urls.add(start_url)
+
+                if self.respect_robots:
+                    await self.load_robots()
+                if self.can_fetch(start_url):
+                    queue.put_nowait((start_url, None))
+                else:
+                    print(f"robots.txtにより取得が禁止されています: {start_url}")
+                if self.use_sitemap:
+                    await self.load_sitemaps(queue)
+
+                workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.max_workers)]
+                await queue.join()
+
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+            self.session = None
+        self.parse_executor = None
+
+        # どのページからもリンクされなかったsitemap.xml由来のページはルート直下とする
+        for url in sorted(self.unlinked_urls):
+            page = self.pages.get(url)
+            if page is not None:
+                self.url_tree['root'].append(ChildRef(url, page.title, page.depth))
+
+    async def _worker(self, queue: asyncio.Queue):
+        """
+        キューからURLを取り出してクロールするワーカー
 
-    def crawl(self, url: str, parent: str = None):
+        Args:
+            queue: (URL, 親URL)を格納するキュー
+        """
+        while True:
+            url, parent = await queue.get()
+            try:
+                await self.crawl(url, parent, queue)
+            except Exception as e:
+                print(f"エラー: {url} - {e}")
+                self.failed_urls[url] = str(e) or "不明なエラー"
+            finally:
+                queue.task_done()
+
+    async def crawl(self, url: str, parent: str, queue: asyncio.Queue):
         """
-        再帰的にページをクロール
+        1ページをクロールし、見つかったリンクをキューに追加
 
         Args:
-            url: クロールするURL
+            url: クロールするURL（正規化済み）
             parent: 親ページのURL
+            queue: (URL, 親URL)を格納するキュー
         """
-        # URLを正規化
-        url = self.normalize_url(url)
-
-        # 訪問済みチェック
-        if url in self.visited_urls:
+        # 他のページのリダイレクト先として取得済みの場合はスキップ
+        if url in self.pages:
             return
 
         # URLから深度を計算
@@ -289,57 +992,181 @@ class SitemapCrawler:
         print(f"クロール中 (深度{depth}): {url}")
 
         # ページ取得
-        html, title, final_url, error = self.get_page_content(url)
-        if html is None:
+        hrefs, title, final_url, error = await self.get_page_content(url)
+
+        # sitemap.xmlから投入したURLは、取得が終わるまでに見つかったリンク元を親とする
+        if parent is None:
+            parent = self.link_parents.pop(url, None)
+
+        if hrefs is None:
             # 取得失敗した場合はfailed_urlsに記録
             self.failed_urls[url] = error or "不明なエラー"
             return
 
-        # 成功した場合のみ訪問済みに追加
-        self.visited_urls.add(url)
+        # 成功した場合のみ訪問済みに追加（タイトルと深度を保存）
+        self.pages[url] = PageRecord(title, depth, parent)
 
         # リダイレクトされた場合、最終URLを正規化して使用
         if final_url and final_url != url:
-            final_url = self.normalize_url(final_url)
+            final_url = sys.intern(self.normalize_url(final_url))
             # リダイレクト先のURLもバリデーション
             if not self.is_valid_url(final_url):
                 # 無効なURLの場合はスキップ（元のURLのみ記録）
                 print(f"  リダイレクト先が無効なURL: {final_url}")
-            elif final_url != url and final_url not in self.visited_urls:
-                # リダイレクト先も訪問済みに追加
-                self.visited_urls.add(final_url)
-                # 最終URLの深度も保存
+            elif final_url != url and final_url not in self.pages:
+                # リダイレクト先も最終URLの深度で訪問済みに追加
                 final_depth = self.calculate_depth(final_url)
-                self.url_titles[final_url] = title
-                self.url_depths[final_url] = final_depth
-
-        # タイトルと深度を保存
-        self.url_titles[url] = title
-        self.url_depths[url] = depth
+                self.pages[final_url] = PageRecord(title, final_depth, parent, 'redirect')
+                self.seen_urls.add(final_url)
 
-        # 親子関係を記録
-        if parent:
-            self.url_tree[parent].append({
-                'url': url,
-                'title': title,
-                'depth': depth
-            })
-        else:
-            # ルートページ
-            self.url_tree['root'].append({
-                'url': url,
-                'title': title,
-                'depth': depth
-            })
+        # 親子関係を記録（親がない場合はルートページ）
+        # リンク元が未発見のsitemap.xml由来のURLは、見つかった時点かクロール終了時に記録
+        if url not in self.unlinked_urls:
+            self.url_tree[parent or 'root'].append(ChildRef(url, title, depth))
 
         # リンク抽出
-        links = self.extract_links(html, url)
+        links = self.filter_links(self.extract_links(hrefs, url))
+
+        # sitemap.xml由来で投入済みのURLは、このページを親として記録
+        self.set_link_parents(links & self.unlinked_urls, url)
+
+        # 未投入のリンクのみキューに追加
+        self.enqueue(queue, links, url)
+
+    def set_link_parents(self, links: Set[str], parent: str):
+        """
+        sitemap.xmlから親なしで投入したURLのリンク元が見つかった場合に、親として記録
+
+        Args:
+            links: リンク元が見つかったURLのセット（正規化済み）
+            parent: リンク元のページURL
+        """
+        links.discard(parent)
+        self.unlinked_urls -= links
 
-        # 各リンクを再帰的にクロール
         for link in links:
-            if link not in self.visited_urls:
-                time.sleep(0.5)  # 負荷軽減のため少し待機
-                self.crawl(link, url)
+            page = self.pages.get(link)
+            if page is None:
+                # まだ取得が終わっていない場合はクロール時に反映
+                self.link_parents[link] = parent
+            else:
+                page.parent = parent
+                self.url_tree[parent].append(ChildRef(link, page.title, page.depth))
+
+    def enqueue(self, queue: asyncio.Queue, links: Set[str], parent: Optional[str]):
+        """
+        未投入かつrobots.txtで許可されたリンクをキューに追加
+
+        Args:
+            queue: (URL, 親URL)を格納するキュー
+            links: 正規化済みURLのセット
+            parent: 親ページのURL
+        """
+        new_links = links - self.seen_urls
+        self.seen_urls.update(new_links)
+
+        # 順序を固定するためソート
+        for link in sorted(new_links):
+            if self.can_fetch(link):
+                queue.put_nowait((link, parent))
+
+    def can_fetch(self, url: str) -> bool:
+        """
+        robots.txtでURLの取得が許可されているかを判定
+
+        Args:
+            url: 対象URL
+
+        Returns:
+            許可されている場合（robots.txtがない場合を含む）True
+        """
+        if self.robots is None:
+            return True
+        return self.robots.can_fetch(self.headers['User-Agent'], url)
+
+    async def fetch_resource(self, url: str, consumer) -> Optional[int]:
+        """
+        robots.txtやsitemap.xmlを取得し、受信したチャンクを順に渡す
+
+        ステータスが200の場合のみ本文をconsumerに渡す
+
+        Args:
+            url: 取得するURL
+            consumer: チャンク（バイト列）を受け取る関数
+
+        Returns:
+            HTTPステータスコード（通信・解析に失敗した場合None）
+        """
+        try:
+            async with self.get_limiter(url):
+                async with self.session.get(url, headers={'Accept': '*/*'},
+                                            timeout=aiohttp.ClientTimeout(total=60)) as response:
+                    if response.status == 200:
+                        async for chunk in response.content.iter_chunked(PARSE_CHUNK_SIZE):
+                            consumer(chunk)
+                    return response.status
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            print(f"エラー: {url} - {e or 'タイムアウト'}")
+            return None
+        except Exception as e:
+            # 壊れたgzip（zlib.error）など、受信内容を解析できない場合はクロールを止めずに読み飛ばす
+            print(f"エラー: {url} - 解析できません ({e})")
+            return None
+
+    async def load_robots(self):
+        """robots.txtを読み込む（401/403の場合は全URL不許可、その他取得できない場合は制限なし）"""
+        robots_url = urljoin(self.base_url, '/robots.txt')
+        body = bytearray()
+        status = await self.fetch_resource(robots_url, body.extend)
+
+        robots = RobotFileParser(robots_url)
+        if status in (401, 403):
+            # urllib.robotparserのread()と同じく、アクセス拒否はサイト全体の拒否とみなす
+            robots.disallow_all = True
+        elif status == 200:
+            robots.parse(body.decode('utf-8', errors='replace').splitlines())
+        else:
+            return
+        self.robots = robots
+
+    async def load_sitemaps(self, queue: asyncio.Queue):
+        """
+        sitemap.xml（robots.txtのSitemap指定を含む）のURLをキューに追加
+
+        Args:
+            queue: (URL, 親URL)を格納するキュー
+        """
+        pending = []
+        if self.robots is not None:
+            pending.extend(self.robots.site_maps() or [])
+        if not pending:
+            sitemap_url = urljoin(self.base_url, '/sitemap.xml')
+            if self.can_fetch(sitemap_url):
+                pending.append(sitemap_url)
+
+        loaded = set()
+        page_urls = []
+        while pending and len(loaded) < MAX_SITEMAPS:
+            sitemap_url = pending.pop(0)
+            if sitemap_url in loaded:
+                continue
+            loaded.add(sitemap_url)
+
+            sitemap = SitemapXmlParser()
+            if await self.fetch_resource(sitemap_url, sitemap.feed) != 200:
+                continue
+            sitemap.close()
+
+            page_urls.extend(sitemap.page_urls)
+            # サイトマップインデックスの場合は子sitemapも読み込む
+            pending.extend(sitemap.sitemap_urls)
+
+        links = self.filter_links(page_urls)
+        if links:
+            print(f"sitemap.xmlから{len(links)}件のURLを取得しました")
+            # リンク元はクロール中に見つかった時点で記録する（set_link_parents）
+            self.unlinked_urls.update(links - self.seen_urls)
+            self.enqueue(queue, links, None)
 
     def get_sorted_urls(self) -> List[Tuple[str, str, int]]:
         """
@@ -348,36 +1175,39 @@ class SitemapCrawler:
         Returns:
             (URL, タイトル, 深度)のリスト
         """
-        urls_data = []
-        for url in self.visited_urls:
-            title = self.url_titles.get(url, '')
-            depth = self.url_depths.get(url, 0)
-            urls_data.append((url, title, depth))
+        urls_data = [(url, page.title, page.depth) for url, page in self.pages.items()]
 
         # URLで五十音順ソート（日本語対応）
-        urls_data.sort(key=lambda x: x[0])
+        urls_data.sort(key=itemgetter(0))
 
         return urls_data
 
-    def export_to_csv(self, filename: str):
+    def get_sorted_failed_urls(self) -> List[Tuple[str, str]]:
+        """
+        取得失敗URLをURL順でソート
+
+        Returns:
+            (URL, エラー理由)のリスト
+        """
+        return sorted(self.failed_urls.items(), key=itemgetter(0))
+
+    def export_to_csv(self, urls_data: List[Tuple[str, str, int]], failed_data: List[Tuple[str, str]], filename: str):
         """
         CSV形式でエクスポート
 
         Args:
+            urls_data: get_sorted_urlsで取得した(URL, タイトル, 深度)のリスト
+            failed_data: get_sorted_failed_urlsで取得した(URL, エラー理由)のリスト
             filename: 出力ファイル名
         """
-        urls_data = self.get_sorted_urls()
-
-        with open(filename, 'w', encoding='utf-8-sig', newline='') as f:
+        with open(filename, 'w', encoding='utf-8-sig', newline='', buffering=1 << 20) as f:
             writer = csv.writer(f)
 
-            for url, title, depth in urls_data:
-                # 階層に応じて列をずらす
-                row = [''] * depth + [url, title]
-                writer.writerow(row)
+            # 階層に応じて列をずらす
+            writer.writerows([''] * depth + [url, title] for url, title, depth in urls_data)
 
             # 取得失敗URLがある場合、最後に追加
-            if self.failed_urls:
+            if failed_data:
                 # 空行を追加
                 writer.writerow([])
                 writer.writerow([])
@@ -385,33 +1215,32 @@ class SitemapCrawler:
                 writer.writerow(['【取得失敗URL一覧】'])
                 writer.writerow(['URL', 'エラー理由'])
 
-                # 失敗URLをソートして出力
-                sorted_failed = sorted(self.failed_urls.items(), key=lambda x: x[0])
-                for url, error in sorted_failed:
-                    writer.writerow([url, error])
+                writer.writerows(failed_data)
 
         print(f"CSV出力完了: {filename}")
-        if self.failed_urls:
-            print(f"  取得失敗URL: {len(self.failed_urls)}件")
+        if failed_data:
+            print(f"  取得失敗URL: {len(failed_data)}件")
 
-    def export_to_html(self, filename: str):
+    def export_to_html(self, urls_data: List[Tuple[str, str, int]], failed_data: List[Tuple[str, str]], filename: str):
         """
         HTML形式（アコーディオン付き）でエクスポート
 
         Args:
+            urls_data: get_sorted_urlsで取得した(URL, タイトル, 深度)のリスト
+            failed_data: get_sorted_failed_urlsで取得した(URL, エラー理由)のリスト
             filename: 出力ファイル名
         """
-        urls_data = self.get_sorted_urls()
-
         # 階層構造を構築
         tree = self._build_tree(urls_data)
 
-        html_content = f"""<!DOCTYPE html>
+        base_url = escape(self.base_url)
+
+        html_head = f"""<!DOCTYPE html>
 <html lang="ja">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>サイトマップ - {self.base_url}</title>
+    <title>サイトマップ - {base_url}</title>
     <style>
         body {{
             font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
@@ -562,7 +1391,7 @@ class SitemapCrawler:
 </head>
 <body>
     <h1>サイトマップ</h1>
-    <p><strong>ベースURL:</strong> {self.base_url}</p>
+    <p><strong>ベースURL:</strong> {base_url}</p>
     <p><strong>総ページ数:</strong> <span id="total-count">{len(urls_data)}</span></p>
 
     <div class="controls">
@@ -573,10 +1402,12 @@ class SitemapCrawler:
     </div>
 
     <div class="tree">
-        {self._generate_tree_html(tree)}
+"""
+
+        html_tail = f"""
     </div>
 
-    {self._generate_failed_urls_html()}
+    {self._generate_failed_urls_html(failed_data)}
 
     <script>
         // LocalStorageのキー
@@ -714,37 +1545,43 @@ class SitemapCrawler:
 </html>
 """
 
+        # ツリー部分は1つの文字列にまとめず、生成しながら書き出す
         with open(filename, 'w', encoding='utf-8') as f:
-            f.write(html_content)
+            f.write(html_head)
+            for part in self._generate_tree_html(tree):
+                f.write(part)
+            f.write(html_tail)
 
         print(f"HTML出力完了: {filename}")
-        if self.failed_urls:
-            print(f"  取得失敗URL: {len(self.failed_urls)}件")
+        if failed_data:
+            print(f"  取得失敗URL: {len(failed_data)}件")
 
-    def _generate_failed_urls_html(self) -> str:
+    def _generate_failed_urls_html(self, failed_data: List[Tuple[str, str]]) -> str:
         """
         取得失敗URL一覧のHTMLを生成
 
+        Args:
+            failed_data: (URL, エラー理由)のリスト
+
         Returns:
             HTML文字列
         """
-        if not self.failed_urls:
+        if not failed_data:
             return ''
 
-        sorted_failed = sorted(self.failed_urls.items(), key=lambda x: x[0])
-
-        rows_html = ''
-        for url, error in sorted_failed:
-            rows_html += f'''
+        rows_html = ''.join(
+            f'''
             <tr>
-                <td><a href="{url}" target="_blank">{url}</a></td>
-                <td class="error-msg">{error}</td>
+                <td><a href="{escape(url)}" target="_blank">{escape(url)}</a></td>
+                <td class="error-msg">{escape(error)}</td>
             </tr>
             '''
+            for url, error in failed_data
+        )
 
         html = f'''
     <div class="failed-section">
-        <h2>取得失敗URL一覧 ({len(self.failed_urls)}件)</h2>
+        <h2>取得失敗URL一覧 ({len(failed_data)}件)</h2>
         <table class="failed-table">
             <thead>
                 <tr>
@@ -772,7 +1609,8 @@ class SitemapCrawler:
             階層ツリー構造
         """
         tree = {'children': []}
-        depth_map = {-1: tree}
+        # ルートから現在のノードまでの経路（深度は先頭から昇順）
+        stack = [tree]
 
         for url, title, depth in urls_data:
             node = {
@@ -782,61 +1620,69 @@ class SitemapCrawler:
                 'children': []
             }
 
-            # 親ノードを探す
-            parent_depth = depth - 1
-            while parent_depth >= -1:
-                if parent_depth in depth_map:
-                    depth_map[parent_depth]['children'].append(node)
-                    depth_map[depth] = node
-                    break
-                parent_depth -= 1
+            # URLが前方一致する（パス上の祖先にあたる）浅いノードが末尾に来るまで戻り、それを親とする
+            # 深度だけで判断すると、/c/がない場合の/c/q/r/が直前の/b/の下に付いてしまう
+            while len(stack) > 1 and (stack[-1]['depth'] >= depth or not url.startswith(stack[-1]['url'])):
+                stack.pop()
+
+            stack[-1]['children'].append(node)
+            stack.append(node)
 
         return tree
 
-    def _generate_tree_html(self, tree: Dict, level: int = 0) -> str:
+    def _generate_tree_html(self, tree: Dict) -> Iterator[str]:
         """
         ツリー構造からHTMLを生成
 
+        再帰せずスタックで深さ優先に辿り、HTML断片を順に返す
+
         Args:
             tree: ツリーノード
-            level: 現在の階層レベル
 
-        Returns:
-            HTML文字列
+        Yields:
+            HTML文字列の断片
         """
-        html = ''
+        # (ノード, 閉じタグを出力するか)のスタック
+        stack = [(node, False) for node in reversed(tree.get('children', []))]
+
+        while stack:
+            node, closing = stack.pop()
+
+            if closing:
+                yield '''
+                    </div>
+                </div>
+                '''
+                continue
 
-        for node in tree.get('children', []):
-            has_children = len(node.get('children', [])) > 0
             # HTMLエスケープ
-            escaped_title = node['title'].replace('"', '&quot;').replace('<', '&lt;').replace('>', '&gt;')
-            escaped_url = node['url'].replace('"', '&quot;')
+            escaped_title = escape(node['title'])
+            escaped_url = escape(node['url'])
+            children = node.get('children', [])
 
-            if has_children:
-                html += f'''
+            if children:
+                yield f'''
                 <div class="tree-item">
                     <div class="toggle">
                         <input type="checkbox" class="url-checkbox checkbox" value="{escaped_url}" data-title="{escaped_title}" checked>
                         <span class="toggle-arrow">▶</span>
-                        <a href="{node['url']}" class="link" target="_blank">{node['title']}</a>
-                        <div class="url">{node['url']}</div>
+                        <a href="{escaped_url}" class="link" target="_blank">{escaped_title}</a>
+                        <div class="url">{escaped_url}</div>
                     </div>
                     <div class="children tree-content">
-                        {self._generate_tree_html(node, level + 1)}
-                    </div>
-                </div>
                 '''
+                # 子要素の後に閉じタグを出力
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(children))
             else:
-                html += f'''
+                yield f'''
                 <div class="tree-item no-children">
                     <input type="checkbox" class="url-checkbox checkbox" value="{escaped_url}" data-title="{escaped_title}" checked>
-                    <a href="{node['url']}" class="link" target="_blank">{node['title']}</a>
-                    <div class="url">{node['url']}</div>
+                    <a href="{escaped_url}" class="link" target="_blank">{escaped_title}</a>
+                    <div class="url">{escaped_url}</div>
                 </div>
                 '''
 
-        return html
-
     def sanitize_filename(self, url: str) -> str:
         """
         URLからファイル名に使える文字列を生成
@@ -875,18 +1721,25 @@ def main():
 
     # クロール実行
     print(f"\nクロールを開始します: {crawler.base_url}\n")
-    crawler.crawl(crawler.base_url)
+    asyncio.run(crawler.crawl_all())
 
-    print(f"\n完了: {len(crawler.visited_urls)} ページを取得しました\n")
+    print(f"\n完了: {len(crawler.pages)} ページを取得しました\n")
 
     # ファイル名生成
     base_filename = crawler.sanitize_filename(base_url)
     csv_filename = f"{base_filename}.csv"
     html_filename = f"{base_filename}.html"
 
-    # エクスポート
-    crawler.export_to_csv(csv_filename)
-    crawler.export_to_html(html_filename)
+    # エクスポート（ソート結果を共有し、CSVとHTMLを並行して書き出す）
+    urls_data = crawler.get_sorted_urls()
+    failed_data = crawler.get_sorted_failed_urls()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(crawler.export_to_csv, urls_data, failed_data, csv_filename),
+            executor.submit(crawler.export_to_html, urls_data, failed_data, html_filename)
+        ]
+        for future in futures:
+            future.result()
 
     print("\n処理完了!")
 
@@ -0,0 +1,240 @@
+import asyncio
+import gzip
+import unittest
+import zlib
+
+from sitemap_crawler import PageParser, PageRecord, SitemapCrawler, SitemapXmlParser, PARSE_CHUNK_SIZE
+
+
+def parse(html: bytes, encoding=None, chunk_size=PARSE_CHUNK_SIZE) -> PageParser:
+    """クローラーと同じくチャンクに分けてPageParserに渡す"""
+    page = PageParser(encoding)
+    for i in range(0, len(html), chunk_size):
+        page.feed(html[i:i + chunk_size])
+    page.close()
+    return page
+
+
+class PageParserEncodingTest(unittest.TestCase):
+    TITLE = 'サイトマップ作成テスト'
+
+    def test_undeclared_utf8(self):
+        # Content-Typeにもmetaタグにも文字コードがないページはUTF-8として扱う
+        html = f'<html><head><title>{self.TITLE}</title></head><body><a href="/a/">a</a></body></html>'.encode('utf-8')
+        page = parse(html)
+        self.assertEqual(page.title, self.TITLE)
+        self.assertEqual(page.hrefs, ['/a/'])
+
+    def test_undeclared_utf8_split_chunks(self):
+        # 先読みサイズをまたいで細かく届く場合も同じ
+        html = ('<html><head><title>' + self.TITLE + '</title></head><body>'
+                + '<p>本文</p>' * 200 + '<a href="/b/">b</a></body></html>').encode('utf-8')
+        page = parse(html, chunk_size=7)
+        self.assertEqual(page.title, self.TITLE)
+        self.assertEqual(page.hrefs, ['/b/'])
+
+    def test_meta_charset(self):
+        html = f'<html><head><meta charset="Shift_JIS"><title>{self.TITLE}</title></head></html>'.encode('shift_jis')
+        self.assertEqual(parse(html).title, self.TITLE)
+
+    def test_meta_charset_after_long_prefix(self):
+        # metaタグの前に1KiBを超えるコメントやscriptがあっても宣言を見つける
+        for prefix in ('<!-- ' + 'x' * 1100 + ' -->', '<script>' + 'var a = 1;' * 300 + '</script>'):
+            html = (f'<html><head>{prefix}<meta charset="shift_jis">'
+                    f'<title>{self.TITLE}</title></head></html>').encode('shift_jis')
+            for chunk_size in (PARSE_CHUNK_SIZE, 7):
+                self.assertEqual(parse(html, chunk_size=chunk_size).title, self.TITLE)
+
+    def test_undeclared_utf8_after_long_head(self):
+        # 宣言がないまま先読み上限を超えた場合はUTF-8とする
+        html = (f'<html><head><script>{"var a = 1;" * 1000}</script>'
+                f'<title>{self.TITLE}</title></head></html>').encode('utf-8')
+        self.assertEqual(parse(html, chunk_size=100).title, self.TITLE)
+
+    def test_header_charset_wins_over_meta(self):
+        html = f'<html><head><meta charset="Shift_JIS"><title>{self.TITLE}</title></head></html>'.encode('utf-8')
+        self.assertEqual(parse(html, 'utf-8').title, self.TITLE)
+
+    def test_unknown_header_charset(self):
+        html = f'<html><head><title>{self.TITLE}</title></head></html>'.encode('utf-8')
+        self.assertEqual(parse(html, 'x-unknown').title, self.TITLE)
+
+    def test_empty_document(self):
+        page = parse(b'')
+        self.assertIsNone(page.title)
+        self.assertEqual(page.hrefs, [])
+
+
+class BuildTreeTest(unittest.TestCase):
+    BASE_URL = 'https://example.com/'
+
+    def build(self, paths):
+        """クロール結果と同じくURL順にソートしてから階層ツリーを構築し、(URL, 子)の入れ子で返す"""
+        crawler = SitemapCrawler(self.BASE_URL, cache_dir=None)
+        for path in paths:
+            url = self.BASE_URL.rstrip('/') + path
+            crawler.pages[url] = PageRecord(title=path, depth=crawler.calculate_depth(url), parent=None)
+
+        def simplify(node):
+            return [(child['url'][len(self.BASE_URL) - 1:], simplify(child)) for child in node['children']]
+
+        return simplify(crawler._build_tree(crawler.get_sorted_urls()))
+
+    def test_missing_intermediate_levels(self):
+        # /c/がないため、/c/q/r/は直前の/b/ではなくパス上の祖先である/の下に付く
+        tree = self.build(['/', '/a/', '/a/x/', '/b/', '/b/y/z/', '/c/q/r/'])
+        self.assertEqual(tree, [
+            ('/', [
+                ('/a/', [('/a/x/', [])]),
+                ('/b/', [('/b/y/z/', [])]),
+                ('/c/q/r/', []),
+            ]),
+        ])
+
+    def test_sibling_sorted_before_parent(self):
+        # '-'は'/'より前にソートされるため/a-b/が/a/より先に来るが、/a-b/x/は/a-b/、/a/x/は/a/の下に付く
+        tree = self.build(['/', '/a/', '/a/x/', '/a-b/', '/a-b/x/'])
+        self.assertEqual(tree, [
+            ('/', [
+                ('/a-b/', [('/a-b/x/', [])]),
+                ('/a/', [('/a/x/', [])]),
+            ]),
+        ])
+
+
+URLSET = b'''<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>https://example.com/a/</loc><lastmod>2025-10-01</lastmod></url>
+  <url><loc> https://example.com/b/ </loc></url>
+</urlset>'''
+
+SITEMAP_INDEX = b'''<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>https://example.com/sitemap-1.xml.gz</loc></sitemap>
+  <sitemap><loc>https://example.com/sitemap-2.xml</loc></sitemap>
+</sitemapindex>'''
+
+CORRUPT_GZIP = b'\x1f\x8b\x08\x00' + b'not really gzip data' * 4
+
+
+def parse_sitemap(data: bytes, chunk_size=PARSE_CHUNK_SIZE) -> SitemapXmlParser:
+    """クローラーと同じくチャンクに分けてSitemapXmlParserに渡す"""
+    sitemap = SitemapXmlParser()
+    for i in range(0, len(data), chunk_size):
+        sitemap.feed(data[i:i + chunk_size])
+    sitemap.close()
+    return sitemap
+
+
+class SitemapXmlParserTest(unittest.TestCase):
+    def test_urlset(self):
+        sitemap = parse_sitemap(URLSET, chunk_size=10)
+        self.assertEqual(sitemap.page_urls, ['https://example.com/a/', 'https://example.com/b/'])
+        self.assertEqual(sitemap.sitemap_urls, [])
+
+    def test_sitemap_index(self):
+        sitemap = parse_sitemap(SITEMAP_INDEX)
+        self.assertEqual(sitemap.page_urls, [])
+        self.assertEqual(sitemap.sitemap_urls, ['https://example.com/sitemap-1.xml.gz',
+                                                'https://example.com/sitemap-2.xml'])
+
+    def test_gzip(self):
+        sitemap = parse_sitemap(gzip.compress(URLSET), chunk_size=10)
+        self.assertEqual(sitemap.page_urls, ['https://example.com/a/', 'https://example.com/b/'])
+
+    def test_corrupt_gzip(self):
+        with self.assertRaises(zlib.error):
+            parse_sitemap(CORRUPT_GZIP)
+
+
+class FakeContent:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    async def iter_chunked(self, size: int):
+        for i in range(0, len(self.body), size):
+            yield self.body[i:i + size]
+
+
+class FakeResponse:
+    def __init__(self, status: int, body: bytes):
+        self.status = status
+        self.content = FakeContent(body)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeSession:
+    """URLごとに(ステータス, 本文)を返すaiohttp.ClientSessionの代わり"""
+
+    def __init__(self, responses):
+        self.responses = responses
+
+    def get(self, url, **kwargs):
+        return FakeResponse(*self.responses.get(url, (404, b'')))
+
+
+class RobotsAndSitemapLoadingTest(unittest.TestCase):
+    BASE_URL = 'https://example.com/'
+
+    def crawler(self, responses) -> SitemapCrawler:
+        crawler = SitemapCrawler(self.BASE_URL, cache_dir=None)
+        crawler.session = FakeSession(responses)
+        return crawler
+
+    def test_robots_denied_disallows_all(self):
+        for status in (401, 403):
+            crawler = self.crawler({'https://example.com/robots.txt': (status, b'')})
+            asyncio.run(crawler.load_robots())
+            self.assertTrue(crawler.robots.disallow_all)
+            self.assertFalse(crawler.can_fetch('https://example.com/'))
+
+    def test_robots_missing_allows_all(self):
+        for status in (404, 500):
+            crawler = self.crawler({'https://example.com/robots.txt': (status, b'')})
+            asyncio.run(crawler.load_robots())
+            self.assertIsNone(crawler.robots)
+            self.assertTrue(crawler.can_fetch('https://example.com/private/'))
+
+    def test_robots_rules(self):
+        crawler = self.crawler({'https://example.com/robots.txt': (200, b'User-agent: *\nDisallow: /private/\n')})
+        asyncio.run(crawler.load_robots())
+        self.assertTrue(crawler.can_fetch('https://example.com/a/'))
+        self.assertFalse(crawler.can_fetch('https://example.com/private/'))
+
+    def test_corrupt_sitemap_is_skipped(self):
+        # 壊れたgzipのsitemapは読み飛ばし、残りのsitemapは読み込む
+        crawler = self.crawler({
+            'https://example.com/sitemap.xml': (200, SITEMAP_INDEX),
+            'https://example.com/sitemap-1.xml.gz': (200, CORRUPT_GZIP),
+            'https://example.com/sitemap-2.xml': (200, URLSET),
+        })
+        queue = asyncio.Queue()
+        asyncio.run(crawler.load_sitemaps(queue))
+        queued = sorted(queue.get_nowait()[0] for _ in range(queue.qsize()))
+        self.assertEqual(queued, ['https://example.com/a/', 'https://example.com/b/'])
+
+
+    def test_sitemap_urls_get_parent_when_linked(self):
+        # sitemap.xml由来のURLも、リンク元のページが見つかればそれを親として記録する
+        crawled, queued = 'https://example.com/deep/page/', 'https://example.com/other/'
+        parent = 'https://example.com/a/b/'
+        crawler = SitemapCrawler(self.BASE_URL, cache_dir=None)
+        crawler.unlinked_urls.update([crawled, queued])
+        crawler.pages[crawled] = PageRecord(title='Deep', depth=2, parent=None)
+
+        crawler.set_link_parents({crawled, queued}, parent)
+
+        self.assertEqual(crawler.pages[crawled].parent, parent)
+        self.assertEqual([child.url for child in crawler.url_tree[parent]], [crawled])
+        self.assertEqual(crawler.link_parents, {queued: parent})
+        self.assertEqual(crawler.unlinked_urls, set())
+        self.assertNotIn('root', crawler.url_tree)
+
+
+if __name__ == '__main__':
+    unittest.main()